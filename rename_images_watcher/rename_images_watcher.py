@@ -9,140 +9,403 @@ Optimisé pour un usage minimal des ressources système.
 import os
 import re
 import time
+import sys
 import json
+import queue
+import sqlite3
+import signal
+import logging
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+try:
+    import readline  # noqa: F401 - édition de ligne et historique pour input() (Unix)
+except ImportError:
+    try:
+        import pyreadline3  # noqa: F401 - équivalent optionnel sous Windows
+    except ImportError:
+        pass
+
+try:
+    from watchdog.events import FileClosedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+    # Seul l'observateur inotify (Linux) signale la fermeture après écriture (IN_CLOSE_WRITE)
+    _CLOSE_EVENTS = Observer.__name__ == "InotifyObserver"
+except ImportError:
+    _CLOSE_EVENTS = False
+
+# Extensions d'images surveillées (tuple pour un seul appel str.endswith)
+_IMG_EXTS = ('.png', '.jpg', '.jpeg')
+
+# Sous-dossier des noms temporaires (ruptures de cycles) : la surveillance n'étant pas
+# récursive, y entrer ou en sortir est signalé comme une suppression ou une création
+TEMP_DIR_NAME = ".renamer_tmp"
+# Délai maximal (s) d'arrivée des événements produits par les passages dans TEMP_DIR_NAME
+OWN_MOVE_TTL = 10.0
+
+# Clé de tri chronologique, en nanosecondes entières : date de création quand le système
+# la fournit, sinon date de modification (sous Linux st_ctime change à chaque renommage)
+if hasattr(os.stat_result, "st_birthtime_ns"):  # Windows, Python 3.12+
+    def creation_ns(stat):
+        return stat.st_birthtime_ns
+elif hasattr(os.stat_result, "st_birthtime"):  # macOS, BSD
+    def creation_ns(stat):
+        return int(stat.st_birthtime * 1e9)
+elif sys.platform == "win32":  # st_ctime est la date de création sous Windows
+    def creation_ns(stat):
+        return stat.st_ctime_ns
+else:
+    def creation_ns(stat):
+        return stat.st_mtime_ns
+
+# Numéros "01".."99" formatés une seule fois (la plupart des dossiers restent en dessous de 100)
+_INDEX_SUFFIXES = tuple(f"{i:02d}" for i in range(100))
+
+
+def index_suffixes(count):
+    """Retourne les numéros formatés "01".."count" pour une réorganisation."""
+    if count < len(_INDEX_SUFFIXES):
+        return _INDEX_SUFFIXES[1:count + 1]
+    return _INDEX_SUFFIXES[1:] + tuple(f"{i:02d}" for i in range(len(_INDEX_SUFFIXES), count + 1))
+
+
+# Détails supplémentaires dans les logs (variable d'environnement RENAMER_DEBUG=1)
+DEBUG = bool(os.environ.get("RENAMER_DEBUG"))
+
+CONFIG_DB = Path(__file__).parent / "watcher_config.db"
+# Ancien fichier JSON, importé une fois dans la base
+LEGACY_CONFIG_FILE = Path(__file__).parent / "watcher_config.txt"
+_config_db = None
+
+logger = logging.getLogger(__name__)
+
+# Vrai pendant que le thread principal attend une commande à l'invite "> "
+_at_prompt = False
+
+
+class MenuRequested(Exception):
+    """Signal SIGUSR1 reçu pendant l'attente d'une commande : ouvrir le menu."""
+
+
+def _request_menu(signum, frame):
+    """Gestionnaire de SIGUSR1 (kill -USR1 <pid>) : interrompt la saisie en cours."""
+    if _at_prompt:
+        raise MenuRequested
+
+
+def read_command(prompt):
+    """Lit une commande ; retourne 'menu' si SIGUSR1 arrive pendant la saisie."""
+    global _at_prompt
+    _at_prompt = True
+    try:
+        return input(prompt)
+    except MenuRequested:
+        print()
+        return "menu"
+    finally:
+        _at_prompt = False
+
+
+def start_log_listener():
+    """Configure le logger du service et démarre son thread d'écriture.
+    
+    Les threads de watchdog et de traitement déposent leurs messages dans une file
+    et reprennent aussitôt ; un seul thread fait les écritures sur la console.
+    Retourne le QueueListener à arrêter en fin de programme (vide la file).
+    """
+    log_queue = queue.Queue()
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, console)
+    
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
+
 
 class ImageRenameHandler(FileSystemEventHandler):
     """Gestionnaire d'événements optimisé pour surveiller les fichiers PNG, JPG et JPEG."""
     
     def __init__(self, prefix="Horizon"):
         self.prefix = prefix
-        self.processing = False
-        self.last_event_time = {}  # Cache pour éviter les événements multiples
+        # Dernier numéro attribué et date du fichier correspondant, par dossier ;
+        # absents = état inconnu, une réorganisation complète est nécessaire
+        self._max_index = {}
+        self._max_created = {}
+        self._compile_prefix_re()
+        self._timers = {}  # Minuteur anti-rebond par fichier, relancé à chaque événement
+        self._timers_lock = threading.Lock()
         self.debounce_delay = 1.5  # Délai anti-rebond augmenté pour les captures d'écran
-        self.temp_files = set()  # Fichiers temporaires créés par le script
-        self.processing_lock = threading.Lock()  # Verrou pour éviter les conflits
+        self._dir_busy = {}  # Sémaphore par dossier : une réorganisation à la fois par dossier
+        self._pending = {}  # Fichiers en attente de réorganisation, par dossier
+        self._dir_state_lock = threading.Lock()  # Protège la création des deux dicts ci-dessus
+        # Renommages faits par le script, à ne pas prendre pour des ajouts extérieurs ; sans
+        # suivi récursif, les passages par le sous-dossier temporaire sont signalés comme
+        # suppressions / créations ((type, chemin) -> expiration)
+        self._own_moves = {}
+        self._own_moves_lock = threading.Lock()
+        workers = os.cpu_count() or 4
+        # Pool partagé pour le traitement des événements (plus de thread par événement)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="img-process")
+        # Pool séparé pour les renommages : un traitement en cours ne peut pas le saturer
+        self._rename_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="img-rename")
+    
+    def shutdown(self):
+        """Arrête les minuteurs et les pools de threads du gestionnaire."""
+        with self._timers_lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._rename_pool.shutdown(wait=False, cancel_futures=True)
         
+    def _filter_event(self, file_path):
+        """Retourne le nom du fichier si l'événement concerne une image à traiter, sinon None."""
+        # Un seul appel endswith (en C) sur le suffixe uniquement
+        if not file_path[-5:].lower().endswith(_IMG_EXTS):
+            return None
+        return os.path.basename(file_path)
+    
+    def _expect_own_move(self, kind, path):
+        """Note qu'un événement kind ("deleted"/"created"/"moved") sur path viendra du script lui-même."""
+        with self._own_moves_lock:
+            self._own_moves[(kind, os.path.abspath(path))] = time.monotonic() + OWN_MOVE_TTL
+    
+    def _is_own_move(self, kind, path):
+        """Consomme l'événement attendu correspondant, s'il existe et n'a pas expiré."""
+        if not self._own_moves:
+            return False
+        now = time.monotonic()
+        with self._own_moves_lock:
+            expires = self._own_moves.pop((kind, os.path.abspath(path)), None)
+            # Purge des attentes jamais satisfaites (plateforme sans cet événement),
+            # pas à chaque événement attendu d'une grosse réorganisation
+            if expires is None or expires < now:
+                for key in [key for key, exp in self._own_moves.items() if exp < now]:
+                    del self._own_moves[key]
+        return expires is not None and expires >= now
+    
     def on_created(self, event):
         """Appelé quand un nouveau fichier est créé."""
-        if not event.is_directory:
-            file_path_lower = event.src_path.lower()
-            if file_path_lower.endswith('.png') or file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg'):
-                file_name = Path(event.src_path).name
-                # Ignorer les fichiers temporaires créés par le script
-                if file_name.startswith('TEMP_') or file_name in self.temp_files:
+        if not event.is_directory and self._filter_event(event.src_path):
+            # Retour depuis le sous-dossier temporaire d'une réorganisation
+            if self._is_own_move("created", event.src_path):
+                return
+            # Fichier déjà numéroté arrivé de l'extérieur : la numérotation connue ne tient plus
+            if self.is_already_renamed(os.path.basename(event.src_path)):
+                self._max_index.pop(Path(os.path.dirname(event.src_path)), None)
+            if _CLOSE_EVENTS:
+                # Fichier vide = encore en cours d'écriture, on_closed prendra le relais.
+                # Sinon il a été déplacé dans le dossier et aucune fermeture ne suivra.
+                try:
+                    if os.stat(event.src_path).st_size == 0:
+                        return
+                except OSError:
                     return
-                print(f"🔍 Événement détecté - Fichier créé: {event.src_path}")
-                self._debounced_process(event.src_path)
+            logger.info(f"🔍 Événement détecté - Fichier créé: {event.src_path}")
+            self._debounced_process(event.src_path)
+    
+    def on_closed(self, event):
+        """Appelé (Linux) quand un fichier ouvert en écriture est fermé : il est complet."""
+        if not event.is_directory and self._filter_event(event.src_path):
+            logger.info(f"🔍 Événement détecté - Fichier écrit: {event.src_path}")
+            self._debounced_process(event.src_path, stable=True)
     
     def on_modified(self, event):
         """Appelé quand un fichier est modifié."""
-        if not event.is_directory:
-            file_path_lower = event.src_path.lower()
-            if file_path_lower.endswith('.png') or file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg'):
-                file_name = Path(event.src_path).name
-                # Ignorer les fichiers temporaires et les fichiers déjà traités récemment
-                if file_name.startswith('TEMP_') or file_name in self.temp_files:
-                    return
-                # Réduire les événements de modification redondants
-                if self.is_already_renamed(file_name):
-                    return
-                print(f"🔍 Événement détecté - Fichier modifié: {event.src_path}")
-                self._debounced_process(event.src_path)
+        # Sous Linux, la fin d'écriture est signalée par on_closed
+        if not event.is_directory and not _CLOSE_EVENTS:
+            file_name = self._filter_event(event.src_path)
+            # Réduire les événements de modification redondants
+            if not file_name or self.is_already_renamed(file_name):
+                return
+            logger.info(f"🔍 Événement détecté - Fichier modifié: {event.src_path}")
+            self._debounced_process(event.src_path)
+    
+    def on_deleted(self, event):
+        """Appelé quand un fichier est supprimé ou sorti du dossier."""
+        if not event.is_directory and self._filter_event(event.src_path):
+            # Départ vers le sous-dossier temporaire d'une réorganisation : pas un trou
+            if self._is_own_move("deleted", event.src_path):
+                return
+            # Un trou dans la numérotation : le prochain fichier passera par une réorganisation
+            self._max_index.pop(Path(os.path.dirname(event.src_path)), None)
     
     def on_moved(self, event):
         """Appelé quand un fichier est déplacé/renommé."""
-        if not event.is_directory:
-            file_path_lower = event.dest_path.lower()
-            if file_path_lower.endswith('.png') or file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg'):
-                file_name = Path(event.dest_path).name
-                # Ignorer les fichiers temporaires
-                if file_name.startswith('TEMP_'):
-                    return
-                print(f"🔍 Événement détecté - Fichier déplacé: {event.dest_path}")
-                self._debounced_process(event.dest_path)
+        if event.is_directory:
+            return
+        dest_dir, dest_name = os.path.split(event.dest_path)
+        # Passage par le sous-dossier temporaire pendant une réorganisation
+        if os.path.basename(dest_dir) == TEMP_DIR_NAME:
+            return
+        # Un fichier numéroté renommé autrement que par le script, ou un nom numéroté
+        # donné à la main, invalide la numérotation
+        if self.is_already_renamed(dest_name):
+            if not self._is_own_move("moved", event.dest_path):
+                self._max_index.pop(Path(dest_dir), None)
+        elif self.is_already_renamed(os.path.basename(event.src_path)):
+            self._max_index.pop(Path(os.path.dirname(event.src_path)), None)
+        if self._filter_event(event.dest_path):
+            logger.info(f"🔍 Événement détecté - Fichier déplacé: {event.dest_path}")
+            self._debounced_process(event.dest_path)
     
-    def _debounced_process(self, file_path):
-        """Traitement avec anti-rebond pour éviter les événements multiples."""
-        current_time = time.time()
-        
-        # Vérifier si cet événement est trop récent par rapport au précédent
-        if file_path in self.last_event_time:
-            time_diff = current_time - self.last_event_time[file_path]
-            if time_diff < self.debounce_delay:
-                print(f"🔄 Événement ignoré (debounce {time_diff:.1f}s < {self.debounce_delay}s): {Path(file_path).name}")
-                return  # Ignorer cet événement (trop récent)
+    def _debounced_process(self, file_path, stable=False):
+        """Traitement avec anti-rebond : un seul traitement, debounce_delay après le dernier événement."""
+        file_name = os.path.basename(file_path)
         
-        self.last_event_time[file_path] = current_time
-        
-        print(f"✅ Événement accepté pour traitement: {Path(file_path).name}")
+        with self._timers_lock:
+            timer = self._timers.pop(file_path, None)
+            if timer is not None:
+                timer.cancel()
+            
+            # Fichier fermé après écriture : inutile d'attendre la fin de la rafale
+            if stable:
+                logger.info(f"✅ Événement accepté pour traitement: {file_name}")
+                self._pool.submit(self.process_new_file, file_path, stable)
+                return
+            
+            if timer is not None:
+                logger.info(f"🔄 Anti-rebond relancé ({self.debounce_delay}s): {file_name}")
+            timer = threading.Timer(self.debounce_delay, self._debounce_expired, args=(file_path, stable))
+            timer.daemon = True
+            self._timers[file_path] = timer
+            timer.start()
+    
+    def _debounce_expired(self, file_path, stable):
+        """Appelé par le minuteur quand aucun événement n'est arrivé pendant debounce_delay."""
+        with self._timers_lock:
+            # Ignorer un minuteur remplacé juste avant son déclenchement
+            if self._timers.get(file_path) is not threading.current_thread():
+                return
+            del self._timers[file_path]
         
-        # Traiter le fichier dans un thread séparé pour ne pas bloquer
-        threading.Thread(target=self.process_new_file, args=(file_path,), daemon=True).start()
+        logger.info(f"✅ Événement accepté pour traitement: {os.path.basename(file_path)}")
+        # Traiter le fichier dans le pool pour ne pas bloquer le thread de watchdog
+        self._pool.submit(self.process_new_file, file_path, stable)
     
-    def process_new_file(self, file_path):
-        """Traite un nouveau fichier PNG détecté."""
+    def process_new_file(self, file_path, stable=False):
+        """Traite un nouveau fichier PNG détecté.
+        
+        stable=True indique que l'écriture est déjà terminée (événement de fermeture),
+        l'attente de stabilisation par sondage est alors inutile.
+        """
         try:
             file_path = Path(file_path)
             
             # Vérifier si le fichier existe avec système de retry
             if not file_path.exists():
-                print(f"⚠️ Fichier pas encore disponible, tentative de retry: {file_path.name}")
+                logger.warning(f"⚠️ Fichier pas encore disponible, tentative de retry: {file_path.name}")
                 # Attendre un peu plus et re-essayer
                 time.sleep(1.0)
                 if not file_path.exists():
-                    print(f"⚠️ Fichier introuvable après retry: {file_path.name}")
+                    logger.warning(f"⚠️ Fichier introuvable après retry: {file_path.name}")
                     return
-                print(f"✅ Fichier trouvé après retry: {file_path.name}")
+                logger.info(f"✅ Fichier trouvé après retry: {file_path.name}")
                 
             if self.is_already_renamed(file_path.name):
-                print(f"⚠️ Fichier déjà renommé: {file_path.name}")
+                logger.warning(f"⚠️ Fichier déjà renommé: {file_path.name}")
                 return
             
-            # Vérifier si un autre thread traite déjà ce fichier spécifique
-            with self.processing_lock:
-                if self.processing:
-                    print(f"⚠️ Traitement en cours, fichier ignoré: {file_path.name}")
-                    return
-                self.processing = True
-            
-            try:
-                # Attendre que le fichier soit stable avec timeout plus long
-                print(f"🔄 Attente de stabilisation: {file_path.name}")
+            # Attendre que le fichier soit stable avec timeout plus long
+            if not stable:
+                logger.info(f"🔄 Attente de stabilisation: {file_path.name}")
                 if not self.wait_for_file_stable(file_path, timeout=5):
-                    print(f"⚠️ Fichier non stable, ignoré: {file_path.name}")
+                    logger.warning(f"⚠️ Fichier non stable, ignoré: {file_path.name}")
                     return
-                
-                print(f"\n🆕 Nouveau fichier détecté: {file_path.name}")
-                # Réorganiser tous les fichiers
-                self.reorganize_all_files(file_path.parent)
-                
-                # Nettoyer le cache des événements anciens
-                self._cleanup_event_cache()
-                
-            finally:
-                with self.processing_lock:
-                    self.processing = False
+            
+            directory = file_path.parent
+            busy, pending = self._dir_gate(directory)
+            pending.append(file_path)
+            self._drain_pending(directory, busy, pending)
                 
         except Exception as e:
-            print(f"❌ Erreur lors du traitement de {file_path}: {e}")
-            with self.processing_lock:
-                self.processing = False
-    
-    def _cleanup_event_cache(self):
-        """Nettoie le cache des événements anciens pour économiser la mémoire."""
-        current_time = time.time()
-        cutoff_time = current_time - (self.debounce_delay * 5)  # Garder 5x le délai
+            logger.error(f"❌ Erreur lors du traitement de {file_path}: {e}")
+    
+    def _dir_gate(self, directory):
+        """Retourne le sémaphore et la file d'attente du dossier (créés au premier appel)."""
+        with self._dir_state_lock:
+            busy = self._dir_busy.setdefault(directory, threading.Semaphore(1))
+            pending = self._pending.setdefault(directory, deque())
+        return busy, pending
+    
+    def _drain_pending(self, directory, busy, pending):
+        """Traite les fichiers en attente du dossier si aucun autre thread ne s'en occupe."""
+        # Un seul thread réorganise le dossier ; les autres déposent leur fichier et
+        # repartent sans attendre. Le thread actif vide la file, puis la revérifie
+        # après avoir libéré le dossier pour qu'aucun fichier ne soit perdu.
+        while pending:
+            if not busy.acquire(blocking=False):
+                return  # Le thread actif prendra ce fichier en compte
+            try:
+                while pending:
+                    batch = []
+                    while pending:
+                        batch.append(pending.popleft())
+                    
+                    logger.info(f"\n🆕 Nouveau fichier détecté: {', '.join(p.name for p in batch)}")
+                    for path in batch:
+                        # Réorganiser tous les fichiers si le chemin rapide ne s'applique pas
+                        if not self._append_new_file(path):
+                            self.reorganize_all_files(directory)
+                            break
+            finally:
+                busy.release()
+    
+    def reorganize_directory(self, directory):
+        """Réorganisation complète demandée hors événement (menu), à son tour sur le dossier."""
+        busy, pending = self._dir_gate(directory)
+        with busy:
+            # Les fichiers en attente sont sur le disque : la réorganisation complète les couvre
+            pending.clear()
+            self.reorganize_all_files(directory)
+        # Fichiers déposés pendant la réorganisation (leur thread est reparti sans attendre)
+        self._drain_pending(directory, busy, pending)
+    
+    def _append_new_file(self, file_path):
+        """Chemin rapide : un fichier plus récent que tous les autres prend le numéro suivant.
+        
+        Retourne False (sans rien renommer) si l'état du dossier n'est pas connu, si le
+        fichier est plus ancien que le dernier numéroté ou si le nom cible est déjà pris.
+        """
+        directory = file_path.parent
+        index = self._max_index.get(directory)
+        if index is None:
+            return False
+        
+        try:
+            created = creation_ns(os.stat(file_path))
+        except OSError:
+            return False
+        if created < self._max_created[directory]:
+            return False  # Arrivé en retard : l'ordre chronologique est à refaire
+        
+        index += 1
+        final_name = f"{self.prefix}_{index:02d}{os.path.splitext(file_path.name)[1].lower()}"
+        final_path = directory / final_name
+        if os.path.lexists(final_path):
+            self._max_index.pop(directory, None)
+            return False
         
-        self.last_event_time = {
-            path: timestamp for path, timestamp in self.last_event_time.items()
-            if timestamp > cutoff_time
-        }
+        self._expect_own_move("moved", final_path)
+        try:
+            os.rename(file_path, final_path)
+        except OSError as e:
+            # La réorganisation complète reprendra ce fichier avec le reste du lot
+            logger.warning(f"⚠️ Renommage impossible pour {file_path.name}: {e}")
+            self._max_index.pop(directory, None)
+            return False
+        self._max_index[directory] = index
+        self._max_created[directory] = created
+        logger.info(f"✅ {file_path.name} → {final_name}")
+        return True
     
     def wait_for_file_stable(self, file_path, timeout=5):
         """Attend que le fichier soit stable (optimisé pour être plus rapide)."""
@@ -153,7 +416,7 @@ class ImageRenameHandler(FileSystemEventHandler):
         while time.time() - start_time < timeout:
             try:
                 if not file_path.exists():
-                    print(f"⚠️ Fichier disparu pendant l'attente: {file_path.name}")
+                    logger.warning(f"⚠️ Fichier disparu pendant l'attente: {file_path.name}")
                     return False
                     
                 current_size = file_path.stat().st_size
@@ -164,7 +427,7 @@ class ImageRenameHandler(FileSystemEventHandler):
                         stable_count += 1
                         # Considérer stable après 2 vérifications identiques pour être plus sûr
                         if stable_count >= 2:
-                            print(f"✅ Fichier stable ({current_size} bytes): {file_path.name}")
+                            logger.info(f"✅ Fichier stable ({current_size} bytes): {file_path.name}")
                             return True
                     else:
                         stable_count = 0
@@ -173,52 +436,84 @@ class ImageRenameHandler(FileSystemEventHandler):
                 time.sleep(0.2)  # Interval adapté
                 
             except (OSError, FileNotFoundError) as e:
-                print(f"⚠️ Erreur d'accès au fichier {file_path.name}: {e}")
+                logger.warning(f"⚠️ Erreur d'accès au fichier {file_path.name}: {e}")
                 return False
         
         # Si on sort de la boucle par timeout, accepter le fichier s'il a une taille > 0
         try:
             final_size = file_path.stat().st_size
             if final_size > 0:
-                print(f"⚠️ Timeout atteint, fichier accepté ({final_size} bytes): {file_path.name}")
+                logger.warning(f"⚠️ Timeout atteint, fichier accepté ({final_size} bytes): {file_path.name}")
                 return True
         except:
             pass
             
-        print(f"❌ Fichier non stable après {timeout}s: {file_path.name}")
+        logger.error(f"❌ Fichier non stable après {timeout}s: {file_path.name}")
         return False
     
+    def _compile_prefix_re(self):
+        """Compile l'expression des noms déjà renommés (à rappeler si le préfixe change)."""
+        # Numérotation à refaire avec le nouveau préfixe
+        self._max_index.clear()
+        self._prefix_us = (self.prefix + "_").lower()
+        self._renamed_re = re.compile(
+            rf"^{re.escape(self.prefix)}_\d{{2,}}\.(png|jpg|jpeg)$", re.IGNORECASE)
+    
     def is_already_renamed(self, filename):
         """Vérifie si un fichier a déjà été renommé."""
-        pattern = rf"^{self.prefix}_\d{{2,}}\.(png|jpg|jpeg)$"
-        return bool(re.match(pattern, filename, re.IGNORECASE))
+        # Rejet rapide sans passer par le moteur d'expressions régulières
+        if filename[:len(self._prefix_us)].lower() != self._prefix_us:
+            return False
+        return self._renamed_re.match(filename) is not None
     
-    def get_creation_time(self, file_path):
-        """Obtient la date de création d'un fichier."""
-        return os.path.getctime(file_path)
+    def scan_image_files(self, directory):
+        """Liste les fichiers PNG, JPG et JPEG du dossier en une seule lecture (os.scandir).
+        
+        Retourne des DirEntry : leur stat() est mis en cache, le tri par date ne coûte
+        donc qu'un stat par fichier (aucun sous Windows).
+        """
+        with os.scandir(directory) as it:
+            return [entry for entry in it
+                    if entry.name.lower().endswith(_IMG_EXTS) and entry.is_file()]
+    
+    def _recover_temp_files(self, directory):
+        """Ramène dans le dossier les fichiers laissés dans le sous-dossier temporaire
+        par une réorganisation interrompue."""
+        temp_dir = directory / TEMP_DIR_NAME
+        try:
+            with os.scandir(temp_dir) as it:
+                leftovers = [entry.name for entry in it if entry.is_file()]
+        except FileNotFoundError:
+            return
+        
+        for name in leftovers:
+            if not os.path.lexists(directory / name):
+                self._expect_own_move("created", directory / name)
+                os.rename(temp_dir / name, directory / name)
+                logger.warning(f"⚠️ Fichier temporaire récupéré: {name}")
+        try:
+            temp_dir.rmdir()
+        except OSError:
+            pass
     
     def check_existing_files(self, directory):
         """Vérifie et traite les fichiers PNG, JPG et JPEG existants au démarrage."""
         try:
+            self._recover_temp_files(directory)
+            
             # Trouver tous les fichiers d'image existants
-            image_files = []
-            for ext in ["*.png", "*.jpg", "*.jpeg"]:
-                image_files.extend(list(directory.glob(ext)))
-                image_files.extend(list(directory.glob(ext.upper())))
+            image_files = self.scan_image_files(directory)
             
             if not image_files:
                 return 0
             
             # Séparer les fichiers déjà renommés des nouveaux
-            new_files = []
-            for file_path in image_files:
-                if not self.is_already_renamed(file_path.name):
-                    new_files.append(file_path)
+            new_files = [entry for entry in image_files if not self.is_already_renamed(entry.name)]
             
             if not new_files:
                 return 0
             
-            print(f"📋 {len(new_files)} fichiers non renommés trouvés")
+            logger.info(f"📋 {len(new_files)} fichiers non renommés trouvés")
             
             # Traiter les fichiers existants (réorganisation complète)
             self.reorganize_all_files(directory)
@@ -226,75 +521,172 @@ class ImageRenameHandler(FileSystemEventHandler):
             return len(new_files)
             
         except Exception as e:
-            print(f"❌ Erreur lors de la vérification initiale: {e}")
+            logger.error(f"❌ Erreur lors de la vérification initiale: {e}")
             return 0
     
+    def _plan_renames(self, moves, temp_for):
+        """Découpe les renommages en séquences indépendantes (chaînes et cycles).
+        
+        moves associe chaque nom actuel à son nom final. Un fichier dont le nom final
+        est libre est renommé directement, ce qui libère son nom pour le suivant de la
+        chaîne ; seuls les cycles passent par un nom temporaire (temp_for), soit N+1
+        renommages pour un cycle de N fichiers au lieu de 2N.
+        Chaque séquence est une liste de (source, destination) à exécuter dans l'ordre.
+        """
+        # Comparaison insensible à la casse (NTFS, APFS)
+        owner = {src.lower(): src for src in moves}
+        # pred[nom] = fichier qui doit prendre ce nom
+        pred = {}
+        for src, dst in moves.items():
+            occupant = owner.get(dst.lower())
+            if occupant is not None:
+                pred[occupant] = src
+        
+        sequences = []
+        done = set()
+        
+        # Chaînes : partir du fichier dont le nom final est libre et remonter
+        for src, dst in moves.items():
+            if dst.lower() in owner:
+                continue
+            seq = []
+            current = src
+            while current is not None:
+                seq.append((current, moves[current]))
+                done.add(current)
+                current = pred.get(current)
+            sequences.append(seq)
+        
+        # Cycles : un seul passage par un nom temporaire pour les rompre
+        for start in moves:
+            if start in done:
+                continue
+            temp_name = temp_for[start]
+            seq = [(start, temp_name)]
+            done.add(start)
+            current = pred[start]
+            while current != start:
+                seq.append((current, moves[current]))
+                done.add(current)
+                current = pred[current]
+            seq.append((temp_name, moves[start]))
+            sequences.append(seq)
+        
+        return sequences
+    
     def reorganize_all_files(self, directory):
         """Réorganise tous les fichiers PNG, JPG et JPEG du dossier."""
+        # L'état connu du dossier n'est rétabli qu'en cas de succès
+        self._max_index.pop(directory, None)
         try:
+            # Un fichier resté dans le sous-dossier temporaire doit être compté
+            self._recover_temp_files(directory)
+            
             # Trouver tous les fichiers d'image
-            image_files = []
-            for ext in ["*.png", "*.jpg", "*.jpeg"]:
-                image_files.extend(list(directory.glob(ext)))
-                image_files.extend(list(directory.glob(ext.upper())))
+            all_files = self.scan_image_files(directory)
             
-            if not image_files:
+            if not all_files:
+                self._max_index[directory] = 0
+                self._max_created[directory] = 0
                 return
             
-            # Trier par date de création
-            all_files = image_files.copy()
-            all_files.sort(key=lambda x: self.get_creation_time(x))
+            # Trier par date de création (stat mis en cache par DirEntry)
+            all_files.sort(key=lambda entry: creation_ns(entry.stat()))
+            last_created = creation_ns(all_files[-1].stat())
             
             # Créer la liste des renommages nécessaires
             temp_names = []
-            files_to_rename = []
+            prefix_us = self.prefix + "_"
+            temp_suffix = "_" + self.prefix
             
-            for i, file_path in enumerate(all_files):
+            for num, entry in zip(index_suffixes(len(all_files)), all_files):
                 # Préserver l'extension originale
-                ext = file_path.suffix.lower()
-                expected_name = f"{self.prefix}_{i+1:02d}{ext}"
-                current_name = file_path.name
+                ext = os.path.splitext(entry.name)[1].lower()
+                expected_name = prefix_us + num + ext
+                current_name = entry.name
                 
                 if current_name != expected_name:
-                    temp_name = f"TEMP_{i+1:02d}_{self.prefix}{ext}"
-                    temp_names.append((file_path, temp_name, expected_name))
-                    files_to_rename.append(file_path)
+                    temp_name = "TEMP_" + num + temp_suffix + ext
+                    # Date conservée depuis le tri : pas de nouveau stat après renommage
+                    temp_names.append((current_name, temp_name, expected_name, creation_ns(entry.stat())))
             
-            if not files_to_rename:
-                print("✅ Fichiers déjà dans le bon ordre chronologique")
+            if not temp_names:
+                logger.info("✅ Fichiers déjà dans le bon ordre chronologique")
+                self._max_index[directory] = len(all_files)
+                self._max_created[directory] = last_created
                 return
             
-            print(f"🔄 Réorganisation de {len(files_to_rename)} fichiers...")
+            logger.info(f"🔄 Réorganisation de {len(temp_names)} fichiers...")
             
-            # Phase 1: Noms temporaires
-            for file_path, temp_name, final_name in temp_names:
-                temp_path = file_path.parent / temp_name
-                # Marquer comme fichier temporaire
-                self.temp_files.add(temp_name)
-                file_path.rename(temp_path)
+            # Un nom temporaire n'est utilisé que pour rompre un cycle ;
+            # éviter ceux déjà présents (restes d'une exécution interrompue)
+            temp_dir = directory / TEMP_DIR_NAME
+            try:
+                taken = {name.lower() for name in os.listdir(temp_dir)}
+            except FileNotFoundError:
+                taken = set()
+            moves = {}
+            temp_for = {}
+            created_for = {}
+            for current_name, temp_name, final_name, created in temp_names:
+                moves[current_name] = final_name
+                created_for[current_name] = created
+                stem, ext = os.path.splitext(temp_name)
+                candidate, n = temp_name, 1
+                while candidate.lower() in taken:
+                    candidate = f"{stem}_{n}{ext}"
+                    n += 1
+                temp_for[current_name] = os.path.join(TEMP_DIR_NAME, candidate)
             
-            # Phase 2: Noms finaux
+            sequences = self._plan_renames(moves, temp_for)
+            # Le dernier renommage d'un cycle part de son nom temporaire
+            has_cycles = any(seq[-1][0] not in moves for seq in sequences)
+            if has_cycles:
+                temp_dir.mkdir(exist_ok=True)
+            # Le dossier n'est pas suivi récursivement : entrée et sortie du sous-dossier
+            # arrivent comme suppression puis création, à ne pas traiter
+            for seq in sequences:
+                for src, dst in seq:
+                    if os.path.dirname(dst) == TEMP_DIR_NAME:
+                        self._expect_own_move("deleted", directory / src)
+                    elif os.path.dirname(src) == TEMP_DIR_NAME:
+                        self._expect_own_move("created", directory / dst)
+                    else:
+                        self._expect_own_move("moved", directory / dst)
+            
+            def run_sequence(seq):
+                for src, dst in seq:
+                    os.rename(directory / src, directory / dst)
+                return seq
+            
+            # Chaînes et cycles indépendants : exécutés en parallèle,
+            # chaque séquence est journalisée dès qu'elle est terminée
+            futures = [self._rename_pool.submit(run_sequence, seq) for seq in sequences]
             renamed_count = 0
-            for file_path, temp_name, final_name in temp_names:
-                temp_path = file_path.parent / temp_name
-                final_path = file_path.parent / final_name
-                
-                old_name = file_path.name
-                temp_path.rename(final_path)
-                
-                # Nettoyer les fichiers temporaires du cache
-                self.temp_files.discard(temp_name)
-                
-                creation_time = datetime.fromtimestamp(self.get_creation_time(final_path))
-                creation_str = creation_time.strftime("%Y-%m-%d %H:%M:%S")
-                
-                print(f"✅ {old_name} → {final_name} (créé le {creation_str})")
-                renamed_count += 1
+            try:
+                for future in as_completed(futures):
+                    for src, _ in future.result():
+                        if src not in moves:
+                            continue  # Sortie du sous-dossier temporaire
+                        if DEBUG:
+                            created = datetime.fromtimestamp(created_for[src] / 1e9)
+                            logger.info(f"✅ {src} → {moves[src]} (créé le {created.strftime('%Y-%m-%d %H:%M:%S')})")
+                        else:
+                            logger.info(f"✅ {src} → {moves[src]}")
+                        renamed_count += 1
+            finally:
+                if has_cycles:
+                    # Un cycle interrompu laisse son premier fichier dans le sous-dossier :
+                    # le ramener une fois toutes les séquences terminées
+                    wait(futures)
+                    self._recover_temp_files(directory)
             
-            print(f"✨ {renamed_count} fichiers réorganisés avec succès!")
+            logger.info(f"✨ {renamed_count} fichiers réorganisés avec succès!")
+            self._max_index[directory] = len(all_files)
+            self._max_created[directory] = last_created
             
         except Exception as e:
-            print(f"❌ Erreur lors de la réorganisation: {e}")
+            logger.error(f"❌ Erreur lors de la réorganisation: {e}")
 
 
 def load_saved_paths():
@@ -314,74 +706,108 @@ def load_saved_paths():
 def save_paths(paths_dict):
     """Cette fonction n'est plus nécessaire car save_prefix gère tout."""
     # Fonction conservée pour compatibilité mais ne fait plus rien
-    # Toutes les données sont maintenant gérées par watcher_config.txt
+    # Toutes les données sont maintenant gérées par watcher_config.db
     pass
 
 
-def load_saved_configs():
-    """Charge la configuration complète (chemins + préfixes)."""
-    config_file = Path(__file__).parent / "watcher_config.txt"
+def get_config_db():
+    """Ouvre (une seule fois) la base SQLite de configuration.
     
-    if not config_file.exists():
-        save_configs({})
-        return {}
+    Mode WAL et écritures ciblées par clé : plusieurs instances du script peuvent
+    enregistrer leur préfixe en même temps sans s'écraser mutuellement.
+    """
+    global _config_db
+    if _config_db is None:
+        conn = sqlite3.connect(CONFIG_DB, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS configs("
+            "key TEXT PRIMARY KEY, path TEXT, name TEXT, prefix TEXT, last_used TEXT)")
+        _migrate_json_config(conn)
+        _config_db = conn
+    return _config_db
+
+
+def close_config_db():
+    """Ferme la base de configuration (le journal WAL est reporté dans la base)."""
+    global _config_db
+    if _config_db is not None:
+        _config_db.close()
+        _config_db = None
+
+
+def _migrate_json_config(conn):
+    """Importe l'ancien watcher_config.txt dans une base encore vide."""
+    if not LEGACY_CONFIG_FILE.exists():
+        return
+    if conn.execute("SELECT 1 FROM configs LIMIT 1").fetchone():
+        return
     
     try:
-        with open(config_file, 'r', encoding='utf-8') as f:
+        with open(LEGACY_CONFIG_FILE, 'r', encoding='utf-8') as f:
             content = f.read().strip()
-            if content:
-                return json.loads(content)
-            else:
-                return {}
-    except (json.JSONDecodeError, FileNotFoundError):
-        return {}
+            configs = json.loads(content) if content else {}
+    except (json.JSONDecodeError, OSError):
+        return
+    
+    conn.executemany(
+        "INSERT OR IGNORE INTO configs(key, path, name, prefix, last_used) VALUES (?, ?, ?, ?, ?)",
+        [(key, config.get("path"), config.get("name"), config.get("prefix"), config.get("last_used"))
+         for key, config in configs.items()])
+    if configs:
+        print(f"📦 {len(configs)} dossiers importés depuis {LEGACY_CONFIG_FILE.name}")
 
 
-def save_configs(configs_dict):
-    """Sauvegarde la configuration complète."""
-    config_file = Path(__file__).parent / "watcher_config.txt"
-    
+def load_saved_configs():
+    """Charge la configuration complète (chemins + préfixes), indexée par clé."""
     try:
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(configs_dict, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"⚠️ Erreur lors de la sauvegarde de la configuration: {e}")
+        rows = get_config_db().execute(
+            "SELECT key, path, name, prefix, last_used FROM configs ORDER BY rowid").fetchall()
+    except sqlite3.Error as e:
+        print(f"⚠️ Erreur lors de la lecture de la configuration: {e}")
+        return {}
+    
+    fields = ("path", "name", "prefix", "last_used")
+    return {row[0]: {field: value for field, value in zip(fields, row[1:]) if value is not None}
+            for row in rows}
 
 
 def get_saved_prefix(path, name):
     """Récupère le préfixe sauvegardé pour un chemin donné."""
-    configs = load_saved_configs()
     key = f"{name}_{path}" if name else path
     
-    if key in configs:
-        return configs[key].get("prefix", name if name else "Horizon")
+    try:
+        row = get_config_db().execute(
+            "SELECT prefix FROM configs WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    
+    if row and row[0]:
+        return row[0]
     
     return name if name else "Horizon"
 
 
 def save_prefix(path, name, prefix):
     """Sauvegarde le préfixe pour un chemin donné."""
-    configs = load_saved_configs()
     key = f"{name}_{path}" if name else path
     
-    configs[key] = {
-        "path": path,
-        "name": name,
-        "prefix": prefix,
-        "last_used": datetime.now().isoformat()
-    }
-    
-    save_configs(configs)
+    try:
+        # Mise à jour en place : l'ordre d'ajout des dossiers est conservé
+        get_config_db().execute(
+            "INSERT INTO configs(key, path, name, prefix, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET path = excluded.path, name = excluded.name, "
+            "prefix = excluded.prefix, last_used = excluded.last_used",
+            (key, path, name, prefix, datetime.now().isoformat()))
+    except sqlite3.Error as e:
+        print(f"⚠️ Erreur lors de la sauvegarde de la configuration: {e}")
 
 
-def display_paths_menu(paths_dict):
-    """Affiche le menu des chemins disponibles."""
+def display_paths_menu(path_items, configs):
+    """Affiche le menu des chemins disponibles (liste (nom, chemin) et configuration chargée)."""
     print("\n📂 Dossiers à surveiller:")
     print("-" * 40)
     
-    configs = load_saved_configs()
-    path_items = list(paths_dict.items())
-    
     for i, (name, path) in enumerate(path_items, 1):
         # Récupérer le préfixe sauvegardé
         key = f"{name}_{path}"
@@ -405,6 +831,9 @@ def display_paths_menu(paths_dict):
 def get_user_choice():
     """Gère la sélection du dossier à surveiller."""
     paths_dict = load_saved_paths()
+    # Instantané réutilisé à chaque affichage du menu, rafraîchi après un ajout
+    path_items = list(paths_dict.items())
+    configs = load_saved_configs()
     
     while True:
         if not paths_dict:
@@ -428,6 +857,8 @@ def get_user_choice():
                     result = add_new_path(paths_dict)
                     if result:
                         return result
+                    path_items = list(paths_dict.items())
+                    configs = load_saved_configs()
                     continue
                     
                 elif choice == "2":
@@ -451,7 +882,7 @@ def get_user_choice():
                 return None, None
                 
         else:
-            display_paths_menu(paths_dict)
+            display_paths_menu(path_items, configs)
             
             try:
                 choice = input("\nVotre choix (numéro ou 'q' pour quitter): ").strip()
@@ -466,7 +897,6 @@ def get_user_choice():
                     continue
                 
                 choice_num = int(choice)
-                path_items = list(paths_dict.items())
                 
                 if 1 <= choice_num <= len(path_items):
                     selected_name, selected_path = path_items[choice_num - 1]
@@ -478,6 +908,8 @@ def get_user_choice():
                     result = add_new_path(paths_dict)
                     if result:
                         return result
+                    path_items = list(paths_dict.items())
+                    configs = load_saved_configs()
                     continue
                     
                 elif choice_num == len(path_items) + 2:
@@ -585,6 +1017,16 @@ def add_new_path(paths_dict):
 
 def main():
     """Fonction principale du service de surveillance."""
+    log_listener = start_log_listener()
+    try:
+        run_service()
+    finally:
+        close_config_db()
+        log_listener.stop()
+
+
+def run_service():
+    """Sélection du dossier, démarrage de la surveillance et boucle interactive."""
     print("🖼️  Service de surveillance et renommage PNG, JPG et JPEG")
     print("=" * 55)
     print("📡 Ce service surveille un dossier et renomme automatiquement")
@@ -642,7 +1084,17 @@ def main():
     # Créer le gestionnaire d'événements et l'observateur
     event_handler = ImageRenameHandler(prefix)
     observer = Observer()
-    observer.schedule(event_handler, directory_path, recursive=False)
+    if _CLOSE_EVENTS:
+        # Limiter le masque inotify aux événements utiles (plus de rafales IN_MODIFY)
+        try:
+            observer.schedule(event_handler, directory_path, recursive=False,
+                              event_filter=[FileCreatedEvent, FileDeletedEvent,
+                                            FileMovedEvent, FileClosedEvent])
+        except TypeError:
+            # watchdog < 4 : pas de filtre d'événements
+            observer.schedule(event_handler, directory_path, recursive=False)
+    else:
+        observer.schedule(event_handler, directory_path, recursive=False)
     
     # Vérifier et traiter les fichiers existants AVANT de démarrer la surveillance
     print("🔍 Vérification des fichiers existants...")
@@ -703,6 +1155,7 @@ def main():
                         if new_prefix:
                             # Mettre à jour le préfixe
                             event_handler.prefix = new_prefix
+                            event_handler._compile_prefix_re()
                             save_prefix(directory_path, shortcut_name, new_prefix)
                             print(f"✅ Préfixe changé pour '{new_prefix}'")
                         input("\nAppuyez sur Entrée pour continuer...")
@@ -712,7 +1165,7 @@ def main():
                 elif choice == "4":
                     print("\n🔄 Réorganisation en cours...")
                     try:
-                        event_handler.reorganize_all_files(Path(directory_path))
+                        event_handler.reorganize_directory(Path(directory_path))
                         print("✅ Réorganisation terminée!")
                     except Exception as e:
                         print(f"❌ Erreur lors de la réorganisation: {e}")
@@ -736,10 +1189,13 @@ def main():
     
     try:
         print("💬 Tapez 'menu' pour les options, 'quit' pour quitter, ou Ctrl+C pour arrêter")
+        if hasattr(signal, "SIGUSR1"):
+            # Ouvrir le menu depuis un autre terminal : kill -USR1 <pid>
+            signal.signal(signal.SIGUSR1, _request_menu)
+            print(f"💡 Menu accessible aussi avec: kill -USR1 {os.getpid()}")
         while True:
             try:
-                # Attendre une entrée utilisateur avec timeout
-                user_input = input("\n> ").strip().lower()
+                user_input = read_command("\n> ").strip().lower()
                 
                 if user_input in ['menu', 'm']:
                     result = handle_interactive_menu()
@@ -760,17 +1216,21 @@ def main():
                     print("💡 Commandes disponibles: 'menu' (options), 'quit' (arrêter)")
                     
             except EOFError:
-                # Gestion des inputs vides ou Ctrl+D
-                time.sleep(0.5)
-                continue
+                # Entrée standard fermée (Ctrl+D, lancement sans console) :
+                # plus de saisie possible, seule la surveillance continue
+                print("\n📡 Entrée fermée, surveillance seule (Ctrl+C pour arrêter)")
+                while observer.is_alive():
+                    observer.join(1)
+                break
                 
     except KeyboardInterrupt:
         print("\n\n🔴 Arrêt du service demandé...")
     
     observer.stop()
-    print("✅ Service arrêté avec succès.")
-    
+    # Plus aucun événement ne peut arriver : les pools peuvent être fermés
     observer.join()
+    event_handler.shutdown()
+    print("✅ Service arrêté avec succès.")
 
 
 if __name__ == "__main__":
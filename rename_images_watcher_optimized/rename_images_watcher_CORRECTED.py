@@ -11,97 +11,198 @@ import re
 import sys
 import time
 import json
+import queue
+import stat
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
 from datetime import datetime
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
 
 
-class ImageRenameHandler(FileSystemEventHandler):
+# Extensions surveillées (tuple : un seul appel à str.endswith)
+_IMG_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def open_dir_fd(directory):
+    """Ouvre le dossier surveillé une fois pour les stat relatifs (_file_size), ou None si non supporté (Windows)."""
+    if not hasattr(os, "O_DIRECTORY") or os.stat not in os.supports_dir_fd:
+        return None
+    try:
+        return os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return None
+
+
+def _try_rename(src, dst):
+    """os.rename sans exception : retourne l'erreur éventuelle (pour les renommages en parallèle)."""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        return e
+    return None
+
+# Détail par fichier des renommages (variable d'environnement RENAMER_DEBUG=1)
+DEBUG = bool(os.environ.get("RENAMER_DEBUG"))
+# Vérification finale après réorganisation, au prix d'un nouveau parcours du dossier (RENAMER_VERIFY=1)
+VERIFY = bool(os.environ.get("RENAMER_VERIFY"))
+
+
+class ImageRenameHandler(PatternMatchingEventHandler):
     """Gestionnaire d'événements optimisé pour surveiller les fichiers PNG, JPG et JPEG."""
     
-    def __init__(self, prefix="Horizon"):
+    def __init__(self, prefix="Horizon", dir_fd=None):
+        # Filtrage par watchdog avant l'appel des on_* : seules les images arrivent ici.
+        # Les noms temporaires du script dépendent du préfixe (modifiable) : écartés par _is_temp_name
+        super().__init__(
+            patterns=[f"*{ext}" for ext in _IMG_EXTS],
+            ignore_directories=True,
+            case_sensitive=False,
+        )
         self.prefix = prefix
-        self.processing = False
-        self.last_event_time = {}
+        # Descripteur du dossier surveillé (voir open_dir_fd) : chemins résolus depuis ce dossier
+        self._dir_fd = dir_fd
+        # Dernier événement accepté par fichier, du plus ancien au plus récent
+        self.last_event_time = OrderedDict()
         self.debounce_delay = 1.5
-        self.temp_files = set()
-        self.processing_lock = threading.Lock()
+        # Réorganisation lancée après une rafale d'arrivées, exécutée par un unique thread
+        self._reorg_timer = None
+        self._reorg_lock = threading.Lock()
+        self.reorg_delay = 0.5
+        self._reorg_queue = queue.Queue()
+        self._reorg_worker = threading.Thread(target=self._drain_reorgs, name="img-reorg", daemon=True)
+        self._reorg_worker.start()
+        # Pool borné pour le traitement des événements (pas un thread par événement)
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="img-rename")
+        # Fichiers refusés récemment (vides, disparus...) : nom -> expiration
+        self._neg_cache = {}
+        self.neg_cache_ttl = 2.0
+        # Fichiers en attente de stabilisation : chemin -> (taille, date du dernier changement)
+        # mis à jour par on_modified, avec un Event pour réveiller _wait_file_stable
+        self._last_sizes = {}
+        self._size_events = {}
+        self.stable_delay = 0.5
+        self._compile_prefix_re()
         
-    def get_real_image_files(self, directory):
-        """Obtient UNIQUEMENT les fichiers images réellement accessibles - méthode ultra-robuste."""
+    def shutdown(self):
+        """Arrête le pool de traitement et la réorganisation en attente (à l'arrêt de l'observer)."""
+        with self._reorg_lock:
+            if self._reorg_timer is not None:
+                self._reorg_timer.cancel()
+                self._reorg_timer = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        # Laisser finir la réorganisation en cours avant de fermer le dossier
+        self._reorg_queue.put(None)
+        self._reorg_worker.join()
+        if self._dir_fd is not None:
+            os.close(self._dir_fd)
+            self._dir_fd = None
+    
+    def get_real_image_files(self, directory, pending=None):
+        """Obtient UNIQUEMENT les fichiers images réellement accessibles - un seul parcours du dossier.
+        
+        Retourne des tuples (chemin, date de création, taille) issus du même stat.
+        Si pending est une liste, y ajoute au passage les fichiers pas encore renommés.
+        """
         real_files = []
+        directory = Path(directory)
+        neg_cache = self._neg_cache
+        now = time.time()
         
-        # Utiliser os.listdir() au lieu de glob() pour éviter les fichiers fantômes Windows
+        # os.scandir() : un seul parcours, type et stat servis par l'entrée du dossier
+        # (sous Windows, les fichiers fantômes n'y apparaissent pas).
+        # Parcours par chemin et non par dir_fd : un descripteur partagé a une seule position
+        # de lecture, deux parcours simultanés se perturberaient (fichiers manqués ou doublés).
         try:
-            all_items = os.listdir(directory)
-            for item in all_items:
-                file_path = directory / item
-                
-                # Vérifier que c'est un fichier (pas un dossier)
-                if not file_path.is_file():
-                    continue
-                
-                # Vérifier l'extension
-                ext = item.lower()
-                if not (ext.endswith('.png') or ext.endswith('.jpg') or ext.endswith('.jpeg')):
-                    continue
-                
-                # Test d'accès ultra-robuste
-                try:
-                    # Test 1: Le fichier existe-t-il vraiment ?
-                    if not file_path.exists():
+            with os.scandir(directory) as it:
+                for entry in it:
+                    name = entry.name
+                    
+                    # Vérifier l'extension
+                    if not name.lower().endswith(_IMG_EXTS):
                         continue
                     
-                    # Test 2: Peut-on accéder aux métadonnées ?
-                    stat_info = file_path.stat()
+                    # Refusé il y a peu : pas de nouveau stat avant expiration
+                    expires = neg_cache.get(name)
+                    if expires and expires > now:
+                        continue
                     
-                    # Test 3: Le fichier a-t-il une taille > 0 ?
-                    if stat_info.st_size <= 0:
+                    # Stat de l'entrée : fourni par le parcours sous Windows, un seul lstat ailleurs
+                    try:
+                        stat_info = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        # Fichier disparu entre-temps ou inaccessible
+                        neg_cache[name] = now + self.neg_cache_ttl
                         continue
                     
-                    # Test 4: Peut-on ouvrir le fichier en lecture ?
-                    with open(file_path, 'rb') as f:
-                        f.read(1)  # Lecture d'un seul byte pour vérifier l'accès
+                    mode, size, ctime = stat_info.st_mode, stat_info.st_size, stat_info.st_ctime
                     
-                    real_files.append(file_path)
+                    # Uniquement des fichiers réguliers non vides. L'ancienne sonde open + read(1)
+                    # des fichiers fantômes est abandonnée : la lecture n'est vérifiée nulle part,
+                    # un fichier illisible est renommé comme les autres.
+                    if not stat.S_ISREG(mode) or size <= 0:
+                        neg_cache[name] = now + self.neg_cache_ttl
+                        continue
                     
-                except (OSError, PermissionError, FileNotFoundError, IOError):
-                    # Skip tous les fichiers inaccessibles
-                    continue
+                    neg_cache.pop(name, None)
+                    file_path = directory / name
+                    real_files.append((file_path, ctime, size))
+                    if pending is not None and not self.is_already_renamed(name):
+                        pending.append(file_path)
                     
         except Exception as e:
             print(f"❌ Erreur lors de la lecture du dossier: {e}")
+        
+        if len(neg_cache) > 512:
+            self._neg_cache = {k: v for k, v in neg_cache.items() if v > now}
             
         return real_files
         
-    def _should_process_file(self, file_path):
-        """Vérifie si un fichier doit être traité."""
-        file_path_lower = file_path.lower()
-        if not (file_path_lower.endswith('.png') or file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg')):
-            return False
-        file_name = Path(file_path).name
-        return not (file_name.startswith('TEMP_') or file_name in self.temp_files)
-    
     def _handle_file_event(self, file_path, event_type):
         """Gestion unifiée des événements de fichiers."""
-        if self._should_process_file(file_path):
-            print(f"🔍 Événement détecté - {event_type}: {file_path}")
-            self._debounced_process(file_path)
+        if self._is_temp_name(os.path.basename(file_path)):
+            return
+        print(f"🔍 Événement détecté - {event_type}: {file_path}")
+        self._debounced_process(file_path)
     
     def on_created(self, event):
-        if not event.is_directory:
-            self._handle_file_event(event.src_path, "Fichier créé")
+        self._handle_file_event(event.src_path, "Fichier créé")
     
     def on_modified(self, event):
-        if not event.is_directory and not self.is_already_renamed(Path(event.src_path).name):
+        self._record_size(event.src_path)
+        if not self.is_already_renamed(os.path.basename(event.src_path)):
             self._handle_file_event(event.src_path, "Fichier modifié")
     
     def on_moved(self, event):
-        if not event.is_directory:
+        # watchdog transmet le déplacement si l'un des deux chemins correspond : vérifier la destination
+        if event.dest_path.lower().endswith(_IMG_EXTS):
             self._handle_file_event(event.dest_path, "Fichier déplacé")
     
+    def _file_size(self, file_path):
+        """Taille d'un fichier du dossier surveillé (stat relatif au dossier ouvert si possible)."""
+        if self._dir_fd is None:
+            return os.stat(file_path).st_size
+        return os.stat(os.path.basename(file_path), dir_fd=self._dir_fd).st_size
+    
+    def _record_size(self, file_path):
+        """Note la nouvelle taille d'un fichier dont on attend la stabilisation."""
+        if not self._size_events:
+            return
+        # Même clé que _wait_file_stable (chemin de l'événement normalisé)
+        key = os.path.normpath(file_path)
+        size_event = self._size_events.get(key)
+        if size_event is None:
+            return
+        try:
+            size = self._file_size(file_path)
+        except OSError:
+            size = -1
+        self._last_sizes[key] = (size, time.time())
+        size_event.set()
+    
     def _debounced_process(self, file_path):
         """Traitement avec anti-rebond."""
         current_time = time.time()
@@ -109,13 +210,15 @@ class ImageRenameHandler(FileSystemEventHandler):
         if file_path in self.last_event_time:
             time_diff = current_time - self.last_event_time[file_path]
             if time_diff < self.debounce_delay:
-                print(f"🔄 Événement ignoré (debounce {time_diff:.1f}s): {Path(file_path).name}")
+                print(f"🔄 Événement ignoré (debounce {time_diff:.1f}s): {os.path.basename(file_path)}")
                 return
         
         self.last_event_time[file_path] = current_time
-        print(f"✅ Événement accepté: {Path(file_path).name}")
+        self.last_event_time.move_to_end(file_path)
+        self._cleanup_cache()
+        print(f"✅ Événement accepté: {os.path.basename(file_path)}")
         
-        threading.Thread(target=self.process_new_file, args=(file_path,), daemon=True).start()
+        self._pool.submit(self.process_new_file, file_path)
     
     def process_new_file(self, file_path):
         """Traite un nouveau fichier PNG détecté."""
@@ -135,66 +238,140 @@ class ImageRenameHandler(FileSystemEventHandler):
                 print(f"⚠️ Fichier déjà renommé: {file_path.name}")
                 return
             
-            with self.processing_lock:
-                if self.processing:
-                    print(f"⚠️ Traitement en cours, ignoré: {file_path.name}")
-                    return
-                self.processing = True
+            print(f"🔄 Attente stabilisation: {file_path.name}")
+            if not self._wait_file_stable(file_path):
+                print(f"⚠️ Fichier non stable: {file_path.name}")
+                return
             
-            try:
-                print(f"🔄 Attente stabilisation: {file_path.name}")
-                if not self._wait_file_stable(file_path):
-                    print(f"⚠️ Fichier non stable: {file_path.name}")
-                    return
-                
-                print(f"\n🆕 Nouveau fichier: {file_path.name}")
-                self.reorganize_all_files(file_path.parent)
-                self._cleanup_cache()
-                
-            finally:
-                with self.processing_lock:
-                    self.processing = False
+            # Le fichier est maintenant complet : ne plus l'écarter du parcours
+            self._neg_cache.pop(file_path.name, None)
+            print(f"\n🆕 Nouveau fichier: {file_path.name}")
+            self._schedule_reorg(file_path.parent)
                 
         except Exception as e:
             print(f"❌ Erreur traitement {file_path}: {e}")
-            with self.processing_lock:
-                self.processing = False
+    
+    def _schedule_reorg(self, directory):
+        """Programme une réorganisation, repoussée à chaque nouvelle arrivée."""
+        with self._reorg_lock:
+            if self._reorg_timer is not None:
+                self._reorg_timer.cancel()
+            self._reorg_timer = threading.Timer(self.reorg_delay, self._do_reorg, args=(directory,))
+            self._reorg_timer.daemon = True
+            self._reorg_timer.start()
+    
+    def _do_reorg(self, directory):
+        """Transmet la réorganisation de toute la rafale au thread de réorganisation."""
+        with self._reorg_lock:
+            if self._reorg_timer is threading.current_thread():
+                self._reorg_timer = None
+        self._reorg_queue.put((directory, None))
+    
+    def reorganize_now(self, directory):
+        """Réorganise via le thread de réorganisation et attend la fin (jamais en parallèle d'une autre)."""
+        done = threading.Event()
+        self._reorg_queue.put((directory, done))
+        done.wait()
+    
+    def _drain_reorgs(self):
+        """Thread de réorganisation : traite les demandes une par une (None = arrêt).
+        
+        Chaque demande est un tuple (dossier, Event à signaler une fois terminé ou None).
+        """
+        while True:
+            request = self._reorg_queue.get()
+            if request is None:
+                return
+            
+            # Demandes arrivées pendant la réorganisation précédente : une seule par dossier
+            pending = {}
+            stop = False
+            while request is not None:
+                directory, done = request
+                pending.setdefault(directory, [])
+                if done is not None:
+                    pending[directory].append(done)
+                try:
+                    request = self._reorg_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+            
+            for directory, waiters in pending.items():
+                try:
+                    self.reorganize_all_files(directory)
+                except Exception as e:
+                    print(f"❌ Erreur réorganisation: {e}")
+                finally:
+                    for done in waiters:
+                        done.set()
+            
+            if stop:
+                return
     
     def _cleanup_cache(self):
-        """Nettoie le cache des événements."""
+        """Nettoie le cache des événements (les plus anciens sont en tête)."""
         cutoff = time.time() - (self.debounce_delay * 5)
-        self.last_event_time = {k: v for k, v in self.last_event_time.items() if v > cutoff}
+        last_event_time = self.last_event_time
+        while last_event_time:
+            if next(iter(last_event_time.values())) > cutoff:
+                break
+            last_event_time.popitem(last=False)
     
     def _wait_file_stable(self, file_path, timeout=5):
-        """Attend la stabilité du fichier."""
-        start_time = time.time()
-        last_size = -1
-        stable_count = 0
+        """Attend la stabilité du fichier (taille inchangée pendant stable_delay).
         
-        while time.time() - start_time < timeout:
-            try:
-                if not file_path.exists():
+        Les changements de taille arrivent par on_modified : pas d'interrogation
+        périodique, un seul stat de contrôle quand le fichier semble stable.
+        """
+        # Chemin normalisé : Path() et watchdog n'écrivent pas toujours le chemin pareil ("./dossier/")
+        key = os.path.normpath(file_path)
+        size_event = self._size_events.setdefault(key, threading.Event())
+        deadline = time.time() + timeout
+        
+        try:
+            while True:
+                size_event.clear()
+                state = self._last_sizes.get(key)
+                if state is None:
+                    # Premier passage (ou état retiré par une autre attente du même fichier)
+                    try:
+                        state = self._last_sizes[key] = (self._file_size(file_path), time.time())
+                    except OSError:
+                        return False
+                current_size, changed_at = state
+                if current_size < 0:
                     return False
-                    
-                current_size = file_path.stat().st_size
-                if current_size > 0:
-                    if current_size == last_size:
-                        stable_count += 1
-                        if stable_count >= 2:
-                            print(f"✅ Fichier stable ({current_size} bytes): {file_path.name}")
-                            return True
-                    else:
-                        stable_count = 0
                 
-                last_size = current_size
-                time.sleep(0.2)
+                now = time.time()
+                if now >= deadline:
+                    break
+                
+                quiet_left = changed_at + self.stable_delay - now
+                if current_size > 0 and quiet_left <= 0:
+                    # Contrôle final, au cas où une écriture n'aurait pas produit d'événement
+                    try:
+                        checked_size = self._file_size(file_path)
+                    except OSError:
+                        return False
+                    if checked_size == current_size:
+                        print(f"✅ Fichier stable ({current_size} bytes): {file_path.name}")
+                        return True
+                    self._last_sizes[key] = (checked_size, time.time())
+                    continue
                 
-            except (OSError, FileNotFoundError):
-                return False
+                # Attendre le prochain événement de modification (ou la fin du délai)
+                wait = deadline - now if current_size <= 0 else min(quiet_left, deadline - now)
+                size_event.wait(wait)
+        finally:
+            if self._size_events.get(key) is size_event:
+                del self._size_events[key]
+                self._last_sizes.pop(key, None)
         
         # Accepter si taille > 0 même après timeout
         try:
-            final_size = file_path.stat().st_size
+            final_size = self._file_size(file_path)
             if final_size > 0:
                 print(f"⚠️ Timeout, fichier accepté ({final_size} bytes): {file_path.name}")
                 return True
@@ -204,15 +381,30 @@ class ImageRenameHandler(FileSystemEventHandler):
         print(f"❌ Fichier non stable après {timeout}s: {file_path.name}")
         return False
     
+    def _compile_prefix_re(self):
+        """Compile le motif des noms déjà renommés (à rappeler après un changement de préfixe)."""
+        # Préfixe en minuscules pour écarter la plupart des noms sans passer par le regex
+        self._prefix_us = (self.prefix + "_").lower()
+        self._renamed_re = re.compile(rf"^{re.escape(self.prefix)}_\d{{2,}}\.(png|jpg|jpeg)$", re.IGNORECASE)
+        # Forme exacte (sensible à la casse) des noms temporaires de reorganize_all_files
+        self._temp_re = re.compile(rf"^TEMP_\d{{2,}}_{re.escape(self.prefix)}\.(png|jpg|jpeg)$")
+    
+    def _is_temp_name(self, filename):
+        """Vérifie si le nom est un nom temporaire du script (TEMP_NN_<préfixe>.ext)."""
+        return filename.startswith("TEMP_") and self._temp_re.match(filename) is not None
+    
     def is_already_renamed(self, filename):
         """Vérifie si déjà renommé."""
-        return bool(re.match(rf"^{self.prefix}_\d{{2,}}\.(png|jpg|jpeg)$", filename, re.IGNORECASE))
+        if filename[:len(self._prefix_us)].lower() != self._prefix_us:
+            return False
+        return self._renamed_re.match(filename) is not None
     
     def check_existing_files(self, directory):
         """Vérifie les fichiers existants au démarrage - VERSION ULTRA-ROBUSTE."""
         try:
-            # Utiliser la méthode ultra-robuste pour obtenir les vrais fichiers
-            existing_files = self.get_real_image_files(directory)
+            # Utiliser la méthode ultra-robuste pour obtenir les vrais fichiers (classés dans le même parcours)
+            new_files = []
+            existing_files = self.get_real_image_files(directory, pending=new_files)
             
             print(f"🔍 Détection robuste: {len(existing_files)} fichiers images réellement accessibles")
             
@@ -220,7 +412,6 @@ class ImageRenameHandler(FileSystemEventHandler):
                 print("📂 Aucun fichier image trouvé")
                 return 0
             
-            new_files = [f for f in existing_files if not self.is_already_renamed(f.name)]
             total_files = len(existing_files)
             new_count = len(new_files)
             
@@ -240,98 +431,103 @@ class ImageRenameHandler(FileSystemEventHandler):
     
     def reorganize_all_files(self, directory):
         """Réorganise tous les fichiers avec numérotation continue garantie."""
+        # Messages regroupés et écrits en une fois à la fin (une écriture console au lieu d'une par fichier)
+        out = []
         try:
             # Utiliser la méthode ultra-robuste
             existing_files = self.get_real_image_files(directory)
             
-            print(f"🔍 Réorganisation: {len(existing_files)} fichiers réellement accessibles")
+            out.append(f"🔍 Réorganisation: {len(existing_files)} fichiers réellement accessibles\n")
             
             if not existing_files:
-                print("📂 Aucun fichier image accessible trouvé")
+                out.append("📂 Aucun fichier image accessible trouvé\n")
                 return
             
-            # Trier par date de création pour préserver l'ordre chronologique
-            existing_files.sort(key=lambda x: os.path.getctime(x))
+            # Trier par date de création (déjà lue pendant le parcours du dossier)
+            existing_files.sort(key=itemgetter(1))
             
             # Afficher l'ordre actuel
-            print("📋 Ordre actuel des fichiers:")
-            for i, f in enumerate(existing_files[:10], 1):  # Afficher les 10 premiers
-                print(f"  {i:02d}. {f.name}")
+            out.append("📋 Ordre actuel des fichiers:\n")
+            for i, (f, _, _) in enumerate(existing_files[:10], 1):  # Afficher les 10 premiers
+                out.append(f"  {i:02d}. {f.name}\n")
             if len(existing_files) > 10:
-                print(f"  ... et {len(existing_files) - 10} autres")
+                out.append(f"  ... et {len(existing_files) - 10} autres\n")
             
-            # Préparer les renommages avec numérotation continue
+            # Préparer les renommages avec numérotation continue (chemins bruts pour os.rename)
+            parent = str(Path(directory))
             renames = []
-            for i, file_path in enumerate(existing_files):
+            for i, (file_path, ctime, _) in enumerate(existing_files):
                 # Préserver l'extension originale
                 ext = file_path.suffix.lower()
                 expected = f"{self.prefix}_{i+1:02d}{ext}"
                 
                 if file_path.name != expected:
                     temp = f"TEMP_{i+1:02d}_{self.prefix}{ext}"
-                    renames.append((file_path, temp, expected))
+                    renames.append((str(file_path), os.path.join(parent, temp), os.path.join(parent, expected), ctime))
             
             if not renames:
-                print("✅ Fichiers déjà dans le bon ordre avec numérotation continue")
+                out.append("✅ Fichiers déjà dans le bon ordre avec numérotation continue\n")
                 return
             
-            print(f"🔄 Réorganisation de {len(renames)} fichiers...")
-            
-            # Phase 1: Noms temporaires pour éviter les conflits
-            successful_phase1 = []
+            out.append(f"🔄 Réorganisation de {len(renames)} fichiers...\n")
             
-            for file_path, temp, final in renames:
-                temp_path = file_path.parent / temp
-                self.temp_files.add(temp)
-                try:
-                    file_path.rename(temp_path)
-                    successful_phase1.append((file_path, temp, final))
-                    print(f"📦 Phase 1: {file_path.name} → {temp}")
-                except Exception as e:
-                    print(f"⚠️ Erreur renommage phase 1: {file_path} → {temp}: {e}")
-                    continue
-            
-            # Phase 2: Noms finaux avec numérotation continue
-            successful_renames = 0
-            for file_path, temp, final in successful_phase1:
-                temp_path = file_path.parent / temp
-                if not temp_path.exists():
-                    continue
-                    
-                final_path = file_path.parent / final
+            # Les renommages d'une même phase sont indépendants : exécutés en parallèle
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                # Phase 1: Noms temporaires pour éviter les conflits
+                errors = executor.map(_try_rename, [r[0] for r in renames], [r[1] for r in renames])
+                successful_phase1 = []
+                for rename, error in zip(renames, errors):
+                    if error is None:
+                        successful_phase1.append(rename)
+                    else:
+                        out.append(f"⚠️ Erreur renommage phase 1: {rename[0]} → {os.path.basename(rename[1])}: {error}\n")
                 
-                old_name = file_path.name
-                try:
-                    temp_path.rename(final_path)
-                    self.temp_files.discard(temp)
+                out.append(f"📦 Phase 1: {len(successful_phase1)} fichiers renommés temporairement\n")
+                
+                # Phase 2: Noms finaux avec numérotation continue
+                # (uniquement les fichiers passés en phase 1 : leur nom temporaire existe)
+                errors = executor.map(_try_rename, [r[1] for r in successful_phase1], [r[2] for r in successful_phase1])
+                successful_renames = 0
+                for (src, temp_path, final_path, ctime), error in zip(successful_phase1, errors):
+                    temp = os.path.basename(temp_path)
+                    final = os.path.basename(final_path)
+                    if error is not None:
+                        out.append(f"❌ Erreur finale: {temp} → {final}: {error}\n")
+                        continue
+                    
                     successful_renames += 1
                     
-                    creation_time = datetime.fromtimestamp(os.path.getctime(final_path))
-                    print(f"✅ {old_name} → {final} (créé le {creation_time.strftime('%Y-%m-%d %H:%M:%S')})")
-                except Exception as e:
-                    print(f"❌ Erreur finale: {temp} → {final}: {e}")
-            
-            print(f"✨ {successful_renames} fichiers réorganisés avec numérotation continue!")
+                    # Détail par fichier uniquement en mode debug
+                    if DEBUG:
+                        # Date lue avant renommage : inutile de refaire un stat
+                        creation_time = datetime.fromtimestamp(ctime)
+                        out.append(f"✅ {os.path.basename(src)} → {final} (créé le {creation_time.strftime('%Y-%m-%d %H:%M:%S')})\n")
             
-            # Vérification finale
-            final_files = self.get_real_image_files(directory)
-            final_files.sort(key=lambda x: os.path.getctime(x))
+            out.append(f"✨ {successful_renames}/{len(renames)} fichiers réorganisés avec numérotation continue!\n")
             
-            print("🔍 Vérification finale de la numérotation:")
-            for i, f in enumerate(final_files[:10], 1):
-                expected_num = f"{i:02d}"
-                actual_num = re.search(rf"{self.prefix}_(\d+)", f.name)
-                if actual_num:
-                    actual_num = actual_num.group(1)
-                    status = "✅" if actual_num == expected_num else "❌"
-                    print(f"  {status} {f.name} (attendu: {expected_num}, trouvé: {actual_num})")
-                else:
-                    print(f"  ❓ {f.name} (format inattendu)")
+            # Vérification finale (nouveau parcours complet du dossier : sur demande uniquement)
+            if VERIFY:
+                final_files = self.get_real_image_files(directory)
+                final_files.sort(key=itemgetter(1))
+                
+                out.append("🔍 Vérification finale de la numérotation:\n")
+                for i, (f, _, _) in enumerate(final_files[:10], 1):
+                    expected_num = f"{i:02d}"
+                    actual_num = re.search(rf"{self.prefix}_(\d+)", f.name)
+                    if actual_num:
+                        actual_num = actual_num.group(1)
+                        status = "✅" if actual_num == expected_num else "❌"
+                        out.append(f"  {status} {f.name} (attendu: {expected_num}, trouvé: {actual_num})\n")
+                    else:
+                        out.append(f"  ❓ {f.name} (format inattendu)\n")
             
         except Exception as e:
-            print(f"❌ Erreur réorganisation: {e}")
+            out.append(f"❌ Erreur réorganisation: {e}\n")
             import traceback
             traceback.print_exc()
+        finally:
+            sys.stdout.write("".join(out))
+            sys.stdout.flush()
 
 
 # === CONFIGURATION ===
@@ -349,26 +545,56 @@ class ConfigManager:
         
         self.config_file = exe_dir / "watcher_config.txt"
         print(f"📁 Fichier de config: {self.config_file}")  # Debug
+        
+        # Configuration gardée en mémoire, invalidée par la date de modification du fichier
+        self._cache = None
+        self._cache_mtime = 0
+    
+    def _file_mtime(self):
+        """Date de modification du fichier de config (0 s'il n'existe pas)."""
+        try:
+            return self.config_file.stat().st_mtime_ns
+        except OSError:
+            return 0
     
     def load_configs(self):
         """Charge la configuration complète."""
-        if not self.config_file.exists():
+        mtime = self._file_mtime()
+        if self._cache is not None and mtime == self._cache_mtime:
+            return self._cache
+        
+        if not mtime:
             self.save_configs({})
             return {}
         
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 content = f.read().strip()
-                return json.loads(content) if content else {}
+                configs = json.loads(content) if content else {}
         except (json.JSONDecodeError, FileNotFoundError):
             return {}
+        
+        self._cache = configs
+        self._cache_mtime = mtime
+        return configs
     
     def save_configs(self, configs):
-        """Sauvegarde la configuration."""
+        """Sauvegarde la configuration (écriture atomique : fichier temporaire puis remplacement)."""
+        tmp_file = self.config_file.with_suffix('.tmp')
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
+            # Pas de fsync : seule l'atomicité compte, pas la durabilité
+            with open(tmp_file, 'w', encoding='utf-8') as f:
                 json.dump(configs, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.config_file)
+            self._cache = configs
+            self._cache_mtime = self._file_mtime()
         except Exception as e:
+            # Le cache a pu être modifié par l'appelant : relire le fichier la prochaine fois
+            self._cache = None
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
             print(f"⚠️ Erreur sauvegarde: {e}")
     
     def get_paths(self):
@@ -593,6 +819,7 @@ def run_interactive_menu(directory_path, prefix, shortcut_name, event_handler):
                 new_prefix = input(f"\nNouveau préfixe (actuel: '{prefix}'): ").strip()
                 if new_prefix:
                     event_handler.prefix = new_prefix
+                    event_handler._compile_prefix_re()
                     config.save_prefix(directory_path, shortcut_name, new_prefix)
                     print(f"✅ Préfixe changé: '{new_prefix}'")
                 input("\nEntrée pour continuer...")
@@ -600,7 +827,7 @@ def run_interactive_menu(directory_path, prefix, shortcut_name, event_handler):
             elif choice == "4":
                 print("\n🔄 Réorganisation...")
                 try:
-                    event_handler.reorganize_all_files(Path(directory_path))
+                    event_handler.reorganize_now(Path(directory_path))
                     print("✅ Terminé!")
                 except Exception as e:
                     print(f"❌ Erreur: {e}")
@@ -672,7 +899,7 @@ def main():
     print(f"   🏷️  Préfixe: {prefix}")
     
     # Démarrage du service
-    event_handler = ImageRenameHandler(prefix)
+    event_handler = ImageRenameHandler(prefix, dir_fd=open_dir_fd(directory_path))
     observer = Observer()
     observer.schedule(event_handler, directory_path, recursive=False)
     
@@ -709,8 +936,10 @@ def main():
         print("\n\n🔴 Arrêt demandé...")
     
     observer.stop()
-    print("✅ Service arrêté.")
+    # Plus aucun événement ne peut arriver : les pools peuvent être fermés
     observer.join()
+    event_handler.shutdown()
+    print("✅ Service arrêté.")
 
 
 if __name__ == "__main__":